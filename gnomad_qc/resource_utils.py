@@ -5,6 +5,20 @@ from typing import Any, Dict, List, Optional, Union
 from gnomad.utils.file_utils import check_file_exists_raise_error
 
 
+def _get_resource_paths(resources: List[Any]) -> List[str]:
+    """
+    Get the unique paths of `resources`, keeping their order.
+
+    Resources can be listed more than once for a step (e.g. when the same input is
+    added by multiple previous steps), so only keep the first occurrence of each path
+    to avoid checking the existence of the same file more than once.
+
+    :param resources: List of resources or paths.
+    :return: List of unique resource paths.
+    """
+    return list(dict.fromkeys(r if isinstance(r, str) else r.path for r in resources))
+
+
 def check_resource_existence(
     input_step_resources: Optional[Dict[str, List]] = None,
     output_step_resources: Optional[Dict[str, List]] = None,
@@ -36,7 +50,7 @@ def check_resource_existence(
     if input_step_resources:
         for step, input_resources in input_step_resources.items():
             check_file_exists_raise_error(
-                [r if isinstance(r, str) else r.path for r in input_resources],
+                _get_resource_paths(input_resources),
                 error_if_not_exists=True,
                 error_if_not_exists_msg=(
                     f"Not all input resources exist. Please add {step} to the command "
@@ -48,7 +62,7 @@ def check_resource_existence(
     if not overwrite and output_step_resources:
         for step, output_resources in output_step_resources.items():
             check_file_exists_raise_error(
-                [r if isinstance(r, str) else r.path for r in output_resources],
+                _get_resource_paths(output_resources),
                 error_if_exists=True,
                 error_if_exists_msg=(
                     f"Some of the output resources that will be created by {step} "
@@ -30,7 +30,7 @@ from gnomad_qc.v3.create_release.hgdp_tgp_constants import (
     VARIANT_ANNOTATIONS,
 )
 from gnomad_qc.v3.resources.annotations import get_freq, get_info
-from gnomad_qc.v3.resources.basics import get_gnomad_v3_mt
+from gnomad_qc.v3.resources.basics import get_checkpoint_path, get_gnomad_v3_mt
 from gnomad_qc.v3.resources.meta import meta
 from gnomad_qc.v3.resources.release import (
     hgdp_tgp_subset,
@@ -212,7 +212,11 @@ def prepare_sample_annotations() -> hl.Table:
         "Removing 'v3.1::' from the sample names, these were added because there are"
         " duplicates of some 1KG/TGP samples in the full gnomAD dataset..."
     )
-    meta_ht = meta_ht.key_by(s=meta_ht.s.replace("v3.1::", ""))
+    meta_ht = meta_ht.key_by(
+        s=hl.if_else(
+            meta_ht.s.startswith("v3.1::"), meta_ht.s[len("v3.1::") :], meta_ht.s
+        )
+    )
     meta_ht = meta_ht.select(
         bam_metrics=meta_ht.bam_metrics,
         sample_qc=meta_ht.sample_qc.select(*SAMPLE_QC_METRICS),
@@ -312,6 +316,7 @@ def prepare_variant_annotations(
 
     # NOTE: Added for v3.1.2 release because this annotation was removed and not a full duplicate of variants in the release HT # noqa
     vep_ht = vep_or_lookup_vep(ht, vep_version=vep_version)
+    vep_ht = vep_ht.select(vep=vep_ht.vep.drop("colocated_variants"))
     vep_ht = vep_ht.annotate_globals(version=f"v{vep_version}")
 
     if file_exists(get_info().path):
@@ -373,6 +378,22 @@ def prepare_variant_annotations(
     freq_index_dict = release_ht.freq_index_dict.collect()[0]
     freq_index_dict = {k: v for k, v in freq_index_dict.items() if v in index_keep}
 
+    # Project the release HT to the fields used in the variant annotations, with
+    # freq already subset to the kept indices, so only these are read in the join
+    release_ht = release_ht.select(
+        "popmax",
+        "faf",
+        "raw_qual_hists",
+        "qual_hists",
+        "age_hist_het",
+        "age_hist_hom",
+        "cadd",
+        "revel",
+        "splice_ai",
+        "primate_ai",
+        freq=hl.array([release_ht.freq[i] for i in index_keep]),
+    )
+
     logger.info("Assembling all variant annotations...")
     filters_ht = filters_ht.annotate(
         allele_info=hl.struct(
@@ -392,7 +413,7 @@ def prepare_variant_annotations(
         rsid=dbsnp_ht[ht.key].rsid,
         filters=keyed_filters.filters,
         info=keyed_info.info,
-        vep=vep_ht[ht.key].vep.drop("colocated_variants"),
+        vep=vep_ht[ht.key].vep,
         vqsr=keyed_filters.vqsr,
         region_flag=region_flag_expr(
             ht,
@@ -401,7 +422,7 @@ def prepare_variant_annotations(
         ),
         allele_info=keyed_filters.allele_info,
         hgdp_tgp_freq=subset_freq[ht.key].freq,
-        gnomad_freq=[keyed_release.freq[i] for i in index_keep],
+        gnomad_freq=keyed_release.freq,
         gnomad_popmax=keyed_release.popmax,
         gnomad_faf=keyed_release.faf,
         gnomad_raw_qual_hists=keyed_release.raw_qual_hists,
@@ -425,6 +446,7 @@ def prepare_variant_annotations(
         for x in hl.eval(subset_freq.freq_meta)
     ]
 
+    release_globals = release_ht.index_globals()
     ht = ht.annotate_globals(
         global_annotation_descriptions=convert_heterogeneous_dict_to_struct(
             GLOBAL_VARIANT_ANNOTATIONS
@@ -440,14 +462,12 @@ def prepare_variant_annotations(
         ),
         gnomad_freq_meta=freq_meta,
         gnomad_freq_index_dict=freq_index_dict,
-        gnomad_faf_index_dict=release_ht.index_globals().faf_index_dict,
-        gnomad_faf_meta=release_ht.index_globals().faf_meta,
-        vep_version=release_ht.index_globals().vep_version,
-        vep_csq_header=release_ht.index_globals().vep_csq_header,
-        dbsnp_version=release_ht.index_globals().dbsnp_version,
-        variant_filtering_model=release_ht.index_globals().filtering_model.drop(
-            "model_id"
-        ),
+        gnomad_faf_index_dict=release_globals.faf_index_dict,
+        gnomad_faf_meta=release_globals.faf_meta,
+        vep_version=release_globals.vep_version,
+        vep_csq_header=release_globals.vep_csq_header,
+        dbsnp_version=release_globals.dbsnp_version,
+        variant_filtering_model=release_globals.filtering_model.drop("model_id"),
         variant_inbreeding_coeff_cutoff=filters_ht.index_globals().inbreeding_coeff_cutoff,
     )
 
@@ -501,17 +521,15 @@ def adjust_subset_alleles(mt: hl.MatrixTable) -> hl.MatrixTable:
     new_to_old = (
         hl.enumerate(mt._keep_allele).filter(lambda elt: elt[1]).map(lambda elt: elt[0])
     )
-    old_to_new_dict = hl.dict(
-        hl.enumerate(
-            hl.enumerate(mt.alleles).filter(lambda elt: mt._keep_allele[elt[0]])
-        ).map(lambda elt: (elt[1][1], elt[0]))
-    )
-    mt = mt.annotate_rows(
-        _old_to_new=hl.bind(
-            lambda d: mt.alleles.map(lambda a: d.get(a)), old_to_new_dict
+    # The new index of a kept allele is the number of kept alleles before it, so the
+    # old to new map can be stored as an array indexed by the old allele index
+    old_to_new = hl.bind(
+        lambda n_kept_before: hl.range(hl.len(mt.alleles)).map(
+            lambda i: hl.or_missing(mt._keep_allele[i], n_kept_before[i])
         ),
-        _new_to_old=new_to_old,
+        hl.array_scan(lambda acc, keep: acc + hl.int32(keep), 0, mt._keep_allele),
     )
+    mt = mt.annotate_rows(_old_to_new=old_to_new, _new_to_old=new_to_old)
     new_locus_alleles = hl.min_rep(
         mt.locus, mt._new_to_old.map(lambda i: mt.alleles[i])
     )
@@ -543,21 +561,31 @@ def create_full_subset_dense_mt(
     :return: Dense release MatrixTable with all row, column, and global annotations
     """
     logger.info(
-        "Adding subset's sample QC metadata to MT columns and global annotations to MT"
-        " globals..."
+        "Adding subset's sample QC metadata to MT columns and sample and variant global"
+        " annotations to MT globals..."
     )
     mt = mt.annotate_cols(**meta_ht[mt.col_key])
+    # Merge the variant globals into the sample globals so that, like two separate
+    # `annotate_globals` calls, variant globals override sample globals of the same
+    # name.
+    meta_globals = meta_ht.drop("global_annotation_descriptions").index_globals()
+    variant_globals = variant_annotation_ht.drop(
+        "global_annotation_descriptions"
+    ).index_globals()
     mt = mt.annotate_globals(
         global_annotation_descriptions=convert_heterogeneous_dict_to_struct(
             GLOBAL_ANNOTATIONS
         ),
-        **meta_ht.drop("global_annotation_descriptions").index_globals(),
+        **meta_globals.annotate(**variant_globals),
     )
 
     logger.info(
         "Annotate entries with het non ref status for use in the homozygous alternate"
         " depletion fix..."
     )
+    # NOTE: This can't be computed lazily at the `hom_alt_depletion_fix` call because
+    # `sparse_split_multi` drops LGT, and the het non ref status can't be recovered
+    # from the split GT and AD
     mt = mt.annotate_entries(_het_non_ref=mt.LGT.is_het_non_ref())
 
     logger.info("Splitting multi-allelics...")
@@ -577,17 +605,17 @@ def create_full_subset_dense_mt(
     )
     # NOTE: Using v3.0 frequencies here and not v3.1 frequencies because the frequency code adjusted genotypes (homalt depletion fix) using v3.0 frequencies # noqa
     # https://github.com/broadinstitute/gnomad_qc/blob/efea6851a421f4bc66b73db588c0eeeb7cd27539/gnomad_qc/v3/annotations/generate_freq_data_hgdp_tgp.py#L129
-    freq_ht = release_sites(public=True).versions["3.0"].ht().select("freq")
+    # Only the full callset AF is needed, so select it directly rather than joining
+    # the full freq array
+    freq_ht = release_sites(public=True).versions["3.0"].ht()
+    freq_ht = freq_ht.select(AF=freq_ht.freq[0].AF)
     mt = hom_alt_depletion_fix(
-        mt, het_non_ref_expr=mt._het_non_ref, af_expr=freq_ht[mt.row_key].freq[0].AF
+        mt, het_non_ref_expr=mt._het_non_ref, af_expr=freq_ht[mt.row_key].AF
     )
     mt = mt.drop("_het_non_ref")
 
-    logger.info("Add all variant annotations and variant global annotations...")
+    logger.info("Add all variant annotations...")
     mt = mt.annotate_rows(**variant_annotation_ht[mt.row_key])
-    mt = mt.annotate_globals(
-        **variant_annotation_ht.drop("global_annotation_descriptions").index_globals()
-    )
 
     logger.info("Removing chrM...")
     mt = hl.filter_intervals(mt, [hl.parse_locus_interval("chrM")], keep=False)
@@ -671,18 +699,40 @@ def main(args):  # noqa: D103
         meta_ht = meta_ht.filter(
             (meta_ht.subsets.hgdp | meta_ht.subsets.tgp | (meta_ht.s == SYNDIP))
         )
-        mt = mt.filter_cols(hl.is_defined(meta_ht[mt.col_key]))
+        mt = mt.semi_join_cols(meta_ht.select().select_globals())
         logger.info("Number of samples in sparse MT: %d", mt.count_cols())
 
         logger.info(
             "Removing 'v3.1::' from the column names, these were added because there"
             " are duplicates of some 1KG/TGP samples in the full gnomAD dataset..."
         )
-        mt = mt.key_cols_by(s=mt.s.replace("v3.1::", ""))
+        mt = mt.key_cols_by(
+            s=hl.if_else(mt.s.startswith("v3.1::"), mt.s[len("v3.1::") :], mt.s)
+        )
+
+        # Only keep the entries needed downstream so the written sparse MT is
+        # already narrowed for the variant annotation HT and dense MT steps
+        mt = mt.select_entries(*SPARSE_ENTRIES)
 
         # Adjust alleles and LA to include only alleles present in the subset
         mt = adjust_subset_alleles(mt)
 
+        if args.sparse_n_partitions:
+            # Checkpoint before the repartition so the allele adjustment (and its
+            # shuffle) is not recomputed when the rows are redistributed
+            logger.info(
+                "Checkpointing the allele adjusted sparse MT and repartitioning to %d"
+                " partitions...",
+                args.sparse_n_partitions,
+            )
+            mt = mt.checkpoint(
+                get_checkpoint_path(
+                    f"hgdp_tgp_subset_sparse{'_test' if test else ''}", mt=True
+                ),
+                overwrite=True,
+            )
+            mt = mt.repartition(args.sparse_n_partitions)
+
         logger.info(
             "NOTE: This sparse MT is the raw subset MT and therefore it does not have"
             " adjusted sex genotypes and the fix for older GATK gVCFs with a known"
@@ -707,9 +757,9 @@ def main(args):  # noqa: D103
         logger.info("Creating variant annotation Hail Table")
         ht = sparse_mt_resource.mt().rows().select().select_globals()
 
-        logger.info("Splitting multi-allelics and filtering out ref block variants...")
-        ht = hl.split_multi(ht)
+        logger.info("Filtering out ref block variants and splitting multi-allelics...")
         ht = ht.filter(hl.len(ht.alleles) > 1)
+        ht = hl.split_multi(ht)
 
         ht = prepare_variant_annotations(
             ht, filter_lowqual=False, vep_version=args.vep_version
@@ -727,7 +777,6 @@ def main(args):  # noqa: D103
         variant_annotation_ht = variant_annotation_resource.ht()
 
         mt = sparse_mt_resource.mt()
-        mt = mt.select_entries(*SPARSE_ENTRIES)
         mt = create_full_subset_dense_mt(mt, meta_ht, variant_annotation_ht)
 
         logger.info(
@@ -761,6 +810,14 @@ if __name__ == "__main__":
         ),
         action="store_true",
     )
+    parser.add_argument(
+        "--sparse_n_partitions",
+        help=(
+            "Number of partitions to repartition the sparse MT to before writing. If"
+            " not set, the partitioning resulting from the allele adjustment is kept."
+        ),
+        type=int,
+    )
     parser.add_argument(
         "--create_variant_annotation_ht",
         help="Create the HGDP + 1KG/TGP subset variant annotation Hail Table.",
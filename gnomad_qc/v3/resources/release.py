@@ -1,5 +1,6 @@
 # noqa: D100
 
+import functools
 from typing import Optional
 
 from gnomad.resources.grch38.gnomad import public_release
@@ -20,6 +21,9 @@ from gnomad_qc.v3.resources.constants import (
     RELEASES,
 )
 
+# The HGDP + 1KG/TGP subset annotation Tables were not created for the v3 release
+_HGDP_TGP_ANNOTATION_RELEASES = tuple(r for r in HGDP_TGP_RELEASES if r != "3")
+
 
 def annotation_hists_path(release_version: str = CURRENT_RELEASE) -> str:
     """
@@ -75,6 +79,7 @@ def release_ht_path(
         )
 
 
+@functools.lru_cache(maxsize=None)
 def release_sites(
     public: bool = False, het_nonref_patch: bool = False
 ) -> VersionedTableResource:
@@ -189,6 +194,7 @@ def append_to_vcf_header_path(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def hgdp_tgp_subset(
     dense: bool = False, test: bool = False
 ) -> VersionedMatrixTableResource:
@@ -210,6 +216,7 @@ def hgdp_tgp_subset(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def hgdp_tgp_subset_annotations(
     sample: bool = True, test: bool = False
 ) -> VersionedTableResource:
@@ -226,8 +233,7 @@ def hgdp_tgp_subset_annotations(
             release: TableResource(
                 f"{qc_temp_prefix(version=release) if test else f'gs://gnomad/release/{release}/ht/'}gnomad.genomes.v{release}.hgdp_1kg_subset{f'_sample_meta' if sample else '_variant_annotations'}.ht"
             )
-            for release in HGDP_TGP_RELEASES
-            if release != "3"
+            for release in _HGDP_TGP_ANNOTATION_RELEASES
         },
     )
 
@@ -1,5 +1,8 @@
 # noqa: D100
 
+import functools
+from typing import Optional, Tuple, Union
+
 import hail as hl
 from gnomad.resources.resource_utils import (
     MatrixTableResource,
@@ -12,6 +15,7 @@ from gnomad.sample_qc.relatedness import get_relationship_expr
 from gnomad_qc.v3.resources.constants import CURRENT_VERSION, VERSIONS
 
 
+@functools.lru_cache(maxsize=None)
 def get_sample_qc_root(version: str = CURRENT_VERSION, mt: bool = False) -> str:
     """
     Return path to sample QC root folder.
@@ -23,6 +27,39 @@ def get_sample_qc_root(version: str = CURRENT_VERSION, mt: bool = False) -> str:
     return f"gs://gnomad/sample_qc/{'mt' if mt else 'ht'}/genomes_v{version}"
 
 
+def _versioned_resource(
+    path: str,
+    resource_cls: type = TableResource,
+    mt: bool = False,
+    excluded_releases: Tuple[str, ...] = (),
+) -> Union[VersionedTableResource, VersionedMatrixTableResource]:
+    """
+    Get a versioned sample QC resource with a version for each release in `VERSIONS`.
+
+    :param path: Path relative to the sample QC root, formatted with `release`
+    :param resource_cls: TableResource or MatrixTableResource. Default is TableResource
+    :param mt: Whether the path is under the MatrixTable sample QC root, default is False
+    :param excluded_releases: Releases that the resource doesn't exist for
+    :return: VersionedTableResource or VersionedMatrixTableResource for `path`
+    """
+    versioned_cls = (
+        VersionedMatrixTableResource
+        if resource_cls is MatrixTableResource
+        else VersionedTableResource
+    )
+    return versioned_cls(
+        CURRENT_VERSION,
+        {
+            release: resource_cls(
+                f"{get_sample_qc_root(release, mt)}/{path.format(release=release)}"
+            )
+            for release in VERSIONS
+            if release not in excluded_releases
+        },
+    )
+
+
+@functools.lru_cache(maxsize=None)
 def get_sample_qc(strat: str = "all") -> VersionedTableResource:
     """
     Get sample QC annotations generated by Hail for the specified stratification.
@@ -35,15 +72,7 @@ def get_sample_qc(strat: str = "all") -> VersionedTableResource:
     :param strat: Which stratification to return
     :return: Sample QC table
     """
-    return VersionedTableResource(
-        CURRENT_VERSION,
-        {
-            release: TableResource(
-                f"{get_sample_qc_root(release)}/sample_qc_{strat}.ht"
-            )
-            for release in VERSIONS
-        },
-    )
+    return _versioned_resource(f"sample_qc_{strat}.ht")
 
 
 def _get_ancestry_pca_ht_path(
@@ -74,6 +103,7 @@ def _get_ancestry_pca_ht_path(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def ancestry_pca_loadings(
     include_unreleasable_samples: bool = False,
     high_quality: bool = False,
@@ -100,6 +130,7 @@ def ancestry_pca_loadings(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def ancestry_pca_scores(
     include_unreleasable_samples: bool = False,
     high_quality: bool = False,
@@ -126,6 +157,7 @@ def ancestry_pca_scores(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def ancestry_pca_eigenvalues(
     include_unreleasable_samples: bool = False,
     high_quality: bool = False,
@@ -167,6 +199,7 @@ def filtered_subpop_qc_mt(pop: str, version: str = CURRENT_VERSION) -> str:
     return f"{get_sample_qc_root(version)}/subpop_analysis/gnomad_v{version}_filtered_subpop_qc_mt.{pop}.mt"
 
 
+@functools.lru_cache(maxsize=None)
 def assigned_subpops(pop: str, version: str = CURRENT_VERSION) -> TableResource:
     """
     Table resource for inferred sample subpopulations.
@@ -180,13 +213,22 @@ def assigned_subpops(pop: str, version: str = CURRENT_VERSION) -> TableResource:
     )
 
 
-def get_relatedness_annotated_ht() -> hl.Table:
+@functools.lru_cache(maxsize=None)
+def get_relatedness_annotated_ht(min_kin: Optional[float] = None) -> hl.Table:
     """
     Relatedness Table annotated with get_relationship_expr.
 
+    :param min_kin: Optional minimum kinship coefficient. If set, pairs with a kinship
+        coefficient below or equal to `min_kin` are removed before the relationship is
+        annotated. Default is None, which keeps all pairs
     :return: Annotated relatedness table
     """
     relatedness_ht = relatedness.ht()
+    # Only the fields used by `get_relationship_expr` are needed
+    relatedness_ht = relatedness_ht.select("kin", "ibd0", "ibd1", "ibd2")
+    if min_kin is not None:
+        relatedness_ht = relatedness_ht.filter(relatedness_ht.kin > min_kin)
+
     return relatedness_ht.annotate(
         relationship=get_relationship_expr(
             kin_expr=relatedness_ht.kin,
@@ -197,6 +239,7 @@ def get_relatedness_annotated_ht() -> hl.Table:
     )
 
 
+@functools.lru_cache(maxsize=None)
 def subpop_outliers(pop: str, version: str = CURRENT_VERSION) -> TableResource:
     """
     Table resource for outlier samples in the subpopulation analysis.
@@ -216,114 +259,45 @@ gnomad_v2_qc_sites = TableResource(
 )
 
 # Dense MT of samples at QC sites
-qc = VersionedMatrixTableResource(
-    CURRENT_VERSION,
-    {
-        release: MatrixTableResource(
-            f"gs://gnomad/sample_qc/mt/genomes_v{release}/gnomad_v{release}_qc_mt_v2_sites_dense.mt"
-        )
-        for release in VERSIONS
-    },
+qc = _versioned_resource(
+    "gnomad_v{release}_qc_mt_v2_sites_dense.mt", MatrixTableResource, mt=True
 )
 
 # PC relate PCA scores
-pc_relate_pca_scores = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_qc_mt_v2_sites_pc_scores.ht"
-        )
-        for release in VERSIONS
-    },
+pc_relate_pca_scores = _versioned_resource(
+    "gnomad_v{release}_qc_mt_v2_sites_pc_scores.ht"
 )
 
 # PC relate results
-relatedness = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_qc_mt_v2_sites_relatedness.ht"
-        )
-        for release in VERSIONS
-    },
-)
+relatedness = _versioned_resource("gnomad_v{release}_qc_mt_v2_sites_relatedness.ht")
 
 # Sex imputation results
-sex = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_sex.ht"
-        )
-        for release in VERSIONS
-    },
-)
+sex = _versioned_resource("gnomad_v{release}_sex.ht")
 
 # Samples to drop for PCA due to them being related
-pca_related_samples_to_drop = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_related_samples_to_drop_for_pca.ht"
-        )
-        for release in VERSIONS
-    },
+pca_related_samples_to_drop = _versioned_resource(
+    "gnomad_v{release}_related_samples_to_drop_for_pca.ht"
 )
 
 # Related samples to drop for release
-release_related_samples_to_drop = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_related_release_samples_to_drop.ht"
-        )
-        for release in VERSIONS
-    },
+release_related_samples_to_drop = _versioned_resource(
+    "gnomad_v{release}_related_release_samples_to_drop.ht"
 )
 
 # Sample inbreeding
-sample_inbreeding = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_inbreeding.ht"
-        )
-        for release in VERSIONS
-    },
-)
+sample_inbreeding = _versioned_resource("gnomad_v{release}_inbreeding.ht")
 
 # Number of clinvar variants per sample
-sample_clinvar_count = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_clinvar.ht"
-        )
-        for release in VERSIONS
-        if release != "3"
-    },
+sample_clinvar_count = _versioned_resource(
+    "gnomad_v{release}_clinvar.ht", excluded_releases=("3",)
 )
 
 # Inferred sample populations
-pop = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_pop.ht"
-        )
-        for release in VERSIONS
-    },
-)
+pop = _versioned_resource("gnomad_v{release}_pop.ht")
 
 # Dense QC MT to use for subpop analyses
-subpop_qc = VersionedMatrixTableResource(
-    CURRENT_VERSION,
-    {
-        release: MatrixTableResource(
-            f"{get_sample_qc_root(release)}/subpop_analysis/gnomad_v{release}_qc_mt_subpop_analysis.mt"
-        )
-        for release in VERSIONS
-    },
+subpop_qc = _versioned_resource(
+    "subpop_analysis/gnomad_v{release}_qc_mt_subpop_analysis.mt", MatrixTableResource
 )
 
 
@@ -366,24 +340,17 @@ def _import_all_hgdp_tgp_pc_scores():
         f"gs://hgdp-1kg/pca_postoutlier/subcont_pca/subcont_pca_*_*scores.txt.bgz",
         impute=True,
     ).key_by("s")
+    # Index each joined Table once and select all PCs from the joined row
+    key = pca_preoutlier_subcont_ht.key
+    postoutlier_subcont = pca_postoutlier_subcont_ht[key]
+    preoutlier_global = pca_preoutlier_global_ht[key]
+    postoutlier_global = pca_postoutlier_global_ht[key]
+    pcs = [f"PC{pc + 1}" for pc in range(n_pcs)]
     hgdp_tgp_pca_ht = pca_preoutlier_subcont_ht.select(
-        pca_scores=[pca_preoutlier_subcont_ht[f"PC{pc + 1}"] for pc in range(n_pcs)],
-        pca_scores_outliers_removed=[
-            pca_postoutlier_subcont_ht[pca_preoutlier_subcont_ht.key][f"PC{pc + 1}"]
-            for pc in range(n_pcs)
-        ],
-        pca_preoutlier_global_scores=[
-            hl.float(
-                pca_preoutlier_global_ht[pca_preoutlier_subcont_ht.key][f"PC{pc + 1}"]
-            )
-            for pc in range(n_pcs)
-        ],
-        pca_postoutlier_global_scores=[
-            hl.float(
-                pca_postoutlier_global_ht[pca_preoutlier_subcont_ht.key][f"PC{pc + 1}"]
-            )
-            for pc in range(n_pcs)
-        ],
+        pca_scores=[pca_preoutlier_subcont_ht[pc] for pc in pcs],
+        pca_scores_outliers_removed=[postoutlier_subcont[pc] for pc in pcs],
+        pca_preoutlier_global_scores=[hl.float(preoutlier_global[pc]) for pc in pcs],
+        pca_postoutlier_global_scores=[hl.float(postoutlier_global[pc]) for pc in pcs],
     )
 
     return hgdp_tgp_pca_ht
@@ -397,116 +364,44 @@ def _import_related_samples_to_drop(**kwargs):
 
 
 # Hard-filtered samples
-hard_filtered_samples = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_hard_filtered_samples.ht"
-        )
-        for release in VERSIONS
-    },
+hard_filtered_samples = _versioned_resource(
+    "gnomad_v{release}_hard_filtered_samples.ht"
 )
 
 # Results of running population-based metrics filtering
 # Not used for v3 release (regresed metrics used instead)
-stratified_metrics = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_stratified_metrics.ht"
-        )
-        for release in VERSIONS
-    },
-)
+stratified_metrics = _versioned_resource("gnomad_v{release}_stratified_metrics.ht")
 
 # Results of running regressed metrics filtering
-regressed_metrics = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_regressed_metrics.ht"
-        )
-        for release in VERSIONS
-    },
-)
+regressed_metrics = _versioned_resource("gnomad_v{release}_regressed_metrics.ht")
 
 # Ranking of all samples based on quality metrics. Used to remove relateds for PCA.
-pca_samples_rankings = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_pca_samples_ranking.ht"
-        )
-        for release in VERSIONS
-    },
-)
+pca_samples_rankings = _versioned_resource("gnomad_v{release}_pca_samples_ranking.ht")
 
 # Ranking of all release samples based on quality metrics. Used to remove
 # relateds for release.
-release_samples_rankings = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_release_samples_ranking.ht"
-        )
-        for release in VERSIONS
-    },
+release_samples_rankings = _versioned_resource(
+    "gnomad_v{release}_release_samples_ranking.ht"
 )
 
 # Picard metrics
-picard_metrics = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_picard_metrics.ht"
-        )
-        for release in VERSIONS
-    },
-)
+picard_metrics = _versioned_resource("gnomad_v{release}_picard_metrics.ht")
 
 # Duplicated (or twin) samples
-duplicates = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v{release}_duplicates.ht"
-        )
-        for release in VERSIONS
-    },
-)
+duplicates = _versioned_resource("gnomad_v{release}_duplicates.ht")
 
 # PCA scores from projection of v3 samples onto v2 PCs
-v2_v3_pc_project_pca_scores = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad_v2_v{release}.pca_project_scores.ht"
-        )
-        for release in VERSIONS
-    },
+v2_v3_pc_project_pca_scores = _versioned_resource(
+    "gnomad_v2_v{release}.pca_project_scores.ht"
 )
 
 # PC relate scores for the sample set that overlaps with v2 samples
-v2_v3_pc_relate_pca_scores = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad__v2_v{release}_release_pca_scores.ht"
-        )
-        for release in VERSIONS
-    },
+v2_v3_pc_relate_pca_scores = _versioned_resource(
+    "gnomad__v2_v{release}_release_pca_scores.ht"
 )
 
 # Relatedness information for the sample set that overlaps with v2 samples
-v2_v3_relatedness = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        release: TableResource(
-            f"{get_sample_qc_root(release)}/gnomad__v2_v{release}_release_relatedness.ht"
-        )
-        for release in VERSIONS
-    },
-)
+v2_v3_relatedness = _versioned_resource("gnomad__v2_v{release}_release_relatedness.ht")
 
 # Table with HGDP + 1KG/TGP metadata from Alicia Martin's group sample QC
 hgdp_tgp_meta = TableResource(
@@ -534,7 +429,8 @@ hgdp_tgp_related_samples_to_drop = TableResource(
     import_func=_import_related_samples_to_drop,
     import_args={
         "paths": "gs://hgdp-1kg/related_sample_ids.txt",
-        "impute": True,
+        # Single column of sample IDs, read as str without an extra type imputation
+        # pass over the file
         "no_header": True,
     },
 )
@@ -38,10 +38,11 @@ from gnomad.utils.filtering import (
     filter_to_clinvar_pathogenic,
 )
 from gnomad.utils.sparse_mt import densify_sites, filter_ref_blocks
+from hail.utils.misc import new_temp_file
 
 from gnomad_qc.v2.resources.sample_qc import get_liftover_v2_qc_mt
 from gnomad_qc.v3.resources.annotations import freq, get_info, last_END_position
-from gnomad_qc.v3.resources.basics import get_gnomad_v3_mt
+from gnomad_qc.v3.resources.basics import get_checkpoint_path, get_gnomad_v3_mt
 from gnomad_qc.v3.resources.meta import meta, meta_tsv_path, project_meta
 from gnomad_qc.v3.resources.sample_qc import (
     ancestry_pca_eigenvalues,
@@ -457,13 +458,9 @@ def run_pca(
     samples_to_drop = related_samples_to_drop.select()
     if not include_unreleasable_samples:
         logger.info("Excluding unreleasable samples for PCA.")
+        qc_meta = project_meta.ht()[qc_mt.col_key]
         samples_to_drop = samples_to_drop.union(
-            qc_mt.filter_cols(
-                ~project_meta.ht()[qc_mt.col_key].releasable
-                | project_meta.ht()[qc_mt.col_key].exclude
-            )
-            .cols()
-            .select()
+            qc_mt.filter_cols(~qc_meta.releasable | qc_meta.exclude).cols().select()
         )
     else:
         logger.info("Including unreleasable samples for PCA")
@@ -471,25 +468,26 @@ def run_pca(
     return run_pca_with_relateds(qc_mt, samples_to_drop, n_pcs=n_pcs)
 
 
-def calculate_mislabeled_training(pop_ht: hl.Table, pop_field: str) -> [int, float]:
+def calculate_mislabeled_training(
+    pop_ht: hl.Table, pop_field: str
+) -> [int, float, int]:
     """
     Calculate the number and proportion of mislabeled training samples.
 
     :param pop_ht: Table with assigned pops/subpops that is returned by `assign_population_pcs`
     :param pop_field: Name of field in the Table containing the assigned pop/subpop
-    :return: The number and proportion of mislabeled training samples
+    :return: The number and proportion of mislabeled training samples, and the number of training samples
     """
-    n_mislabeled_samples = pop_ht.aggregate(
-        hl.agg.count_where(pop_ht.training_pop != pop_ht[pop_field])
-    )
-
-    defined_training_pops = pop_ht.aggregate(
-        hl.agg.count_where(hl.is_defined(pop_ht.training_pop))
+    n_mislabeled_samples, defined_training_pops = pop_ht.aggregate(
+        (
+            hl.agg.count_where(pop_ht.training_pop != pop_ht[pop_field]),
+            hl.agg.count_where(hl.is_defined(pop_ht.training_pop)),
+        )
     )
 
     prop_mislabeled_samples = n_mislabeled_samples / defined_training_pops
 
-    return n_mislabeled_samples, prop_mislabeled_samples
+    return n_mislabeled_samples, prop_mislabeled_samples, defined_training_pops
 
 
 def assign_pops(
@@ -645,13 +643,9 @@ def assign_pops(
             " max_proportion_mislabeled_training_samples must be set!"
         )
 
-    logger.info(
-        "Running RF using {} training examples".format(
-            pop_pca_scores_ht.aggregate(
-                hl.agg.count_where(hl.is_defined(pop_pca_scores_ht.training_pop))
-            )
-        )
-    )
+    # Persist the prepared Table once so the metadata join and withheld sample
+    # selection are not recomputed by the RF and the mislabeled sample counts
+    pop_pca_scores_ht = pop_pca_scores_ht.persist()
 
     pop_ht, pops_rf_model = assign_population_pcs(
         pop_pca_scores_ht,
@@ -663,9 +657,12 @@ def assign_pops(
     )
 
     # Calculate number and proportion of mislabeled samples
-    n_mislabeled_samples, prop_mislabeled_samples = calculate_mislabeled_training(
-        pop_ht, pop_field
-    )
+    (
+        n_mislabeled_samples,
+        prop_mislabeled_samples,
+        n_training_samples,
+    ) = calculate_mislabeled_training(pop_ht, pop_field)
+    logger.info(f"Ran RF using {n_training_samples} training examples")
 
     if max_number_mislabeled_training_samples:
         mislabeled = n_mislabeled_samples
@@ -673,7 +670,7 @@ def assign_pops(
         mislabeled = prop_mislabeled_samples
 
     pop_ht = pop_ht.annotate(
-        training_pop_all=pop_pca_scores_ht[pop_ht.key].training_pop_all
+        **pop_pca_scores_ht[pop_ht.key].select("training_pop_all", "withheld_sample")
     )
     pop_assignment_iter = 1
     while mislabeled > max_mislabeled:
@@ -685,6 +682,7 @@ def assign_pops(
         )
 
         pop_ht = pop_ht[pop_pca_scores_ht.key]
+        prev_pop_pca_scores_ht = pop_pca_scores_ht
         pop_pca_scores_ht = pop_pca_scores_ht.annotate(
             training_pop=hl.or_missing(
                 (pop_ht.training_pop == pop_ht[pop_field]),
@@ -697,14 +695,6 @@ def assign_pops(
             ),
         ).persist()
 
-        logger.info(
-            "Running RF using {} training examples".format(
-                pop_pca_scores_ht.aggregate(
-                    hl.agg.count_where(hl.is_defined(pop_pca_scores_ht.training_pop))
-                )
-            )
-        )
-
         pop_ht, pops_rf_model = assign_population_pcs(
             pop_pca_scores_ht,
             pc_cols=pcs,
@@ -715,19 +705,33 @@ def assign_pops(
         )
 
         pop_ht = pop_ht.annotate(
-            training_pop_all=pop_pca_scores_ht[pop_ht.key].training_pop_all
+            **pop_pca_scores_ht[pop_ht.key].select(
+                "training_pop_all", "withheld_sample"
+            )
         )
 
         # Calculate number and proportion of mislabeled samples
-        n_mislabeled_samples, prop_mislabeled_samples = calculate_mislabeled_training(
-            pop_ht, pop_field
-        )
+        (
+            n_mislabeled_samples,
+            prop_mislabeled_samples,
+            n_training_samples,
+        ) = calculate_mislabeled_training(pop_ht, pop_field)
+        logger.info(f"Ran RF using {n_training_samples} training examples")
+
+        # The new labels have now been computed from the previous iteration's
+        # cached Table, so it can be released
+        prev_pop_pca_scores_ht.unpersist()
 
         if max_number_mislabeled_training_samples:
             mislabeled = n_mislabeled_samples
         else:
             mislabeled = prop_mislabeled_samples
 
+    # Write out the final assignments so the last cached scores Table, which they
+    # are computed from, can be released
+    pop_ht = pop_ht.checkpoint(new_temp_file("assign_pops", extension="ht"))
+    pop_pca_scores_ht.unpersist()
+
     pop_ht = pop_ht.annotate_globals(
         min_prob=min_prob,
         include_unreleasable_samples=include_unreleasable_samples,
@@ -741,9 +745,6 @@ def assign_pops(
     )
     if withhold_prop:
         pop_ht = pop_ht.annotate_globals(withhold_prop=withhold_prop)
-    pop_ht = pop_ht.annotate(
-        withheld_sample=pop_pca_scores_ht[pop_ht.key].withheld_sample
-    )
 
     return pop_ht, pops_rf_model
 
@@ -856,9 +857,12 @@ def get_relatedness_set_ht(relatedness_ht: hl.Table) -> hl.Table:
     :rtype: hl.Table
     """
     relatedness_ht = relatedness_ht.filter(relatedness_ht.relationship != UNRELATED)
-    relatedness_ht = relatedness_ht.select("relationship", s=relatedness_ht.i.s).union(
-        relatedness_ht.select("relationship", s=relatedness_ht.j.s)
+    # Emit one row per sample in each pair by exploding the pair instead of
+    # unioning two copies of the filtered Table
+    relatedness_ht = relatedness_ht.key_by().select(
+        "relationship", s=hl.array([relatedness_ht.i.s, relatedness_ht.j.s])
     )
+    relatedness_ht = relatedness_ht.explode("s")
     relatedness_ht = relatedness_ht.group_by(relatedness_ht.s).aggregate(
         relationships=hl.agg.collect_as_set(relatedness_ht.relationship)
     )
@@ -913,17 +917,19 @@ def join_tables(
         logger.warning("Sample counts in left and right tables do not match!")
 
         in_left_not_right = left_ht.anti_join(right_ht)
-        if in_left_not_right.count() != 0:
+        n_in_left_not_right = in_left_not_right.count()
+        if n_in_left_not_right != 0:
             logger.warning(
-                f"The following {in_left_not_right.count()} samples are found in the"
+                f"The following {n_in_left_not_right} samples are found in the"
                 " left HT, but are not found in the right HT"
             )
             in_left_not_right.select().show(n=-1)
 
         in_right_not_left = right_ht.anti_join(left_ht)
-        if in_right_not_left.count() != 0:
+        n_in_right_not_left = in_right_not_left.count()
+        if n_in_right_not_left != 0:
             logger.warning(
-                f"The following {in_right_not_left.count()} samples are found in the"
+                f"The following {n_in_right_not_left} samples are found in the"
                 " right HT, but are not found in left HT"
             )
             in_right_not_left.select().show(n=-1)
@@ -1010,19 +1016,13 @@ def generate_metadata(regressed_metrics_outlier: bool = True) -> hl.Table:
     hard_filters = ex_right_ht.aggregate(
         hl.agg.collect_as_set(ex_right_ht.hard_filters)
     )
+    # Samples missing from the hard filters HT have no hard filters
+    hard_filters_expr = hl.or_else(left_ht.hard_filters, hl.empty_set(hl.tstr))
     left_ht = left_ht.transmute(
         sample_filters=hl.struct(
-            **{
-                v: hl.if_else(
-                    hl.is_defined(left_ht.hard_filters),
-                    left_ht.hard_filters.contains(v),
-                    False,
-                )
-                for v in hard_filters
-            },
+            **{v: hard_filters_expr.contains(v) for v in hard_filters},
             hard_filters=left_ht.hard_filters,
-            hard_filtered=hl.is_defined(left_ht.hard_filters)
-            & (hl.len(left_ht.hard_filters) > 0),
+            hard_filtered=hl.len(hard_filters_expr) > 0,
         )
     )
 
@@ -1032,7 +1032,11 @@ def generate_metadata(regressed_metrics_outlier: bool = True) -> hl.Table:
     )
     related_samples_to_drop_ht = pca_related_samples_to_drop.ht()
     release_related_samples_to_drop_ht = release_related_samples_to_drop.ht()
-    relatedness_ht = get_relatedness_set_ht(relatedness.ht())
+    # Checkpoint the per-sample relationships since they are joined onto both
+    # related samples to drop HTs and the meta HT
+    relatedness_ht = get_relatedness_set_ht(relatedness.ht()).checkpoint(
+        get_checkpoint_path("relatedness_set"), overwrite=True
+    )
     related_samples_to_drop_ht = related_samples_to_drop_ht.annotate(
         relationships=relatedness_ht[related_samples_to_drop_ht.s].relationships
     )
@@ -1045,14 +1049,18 @@ def generate_metadata(regressed_metrics_outlier: bool = True) -> hl.Table:
     # Any sample that was filtered for relatedness will have True for sample_filters.related
     # If a filtered related sample had a relationship with a higher degree than second-degree (duplicate, parent-child, sibling),
     # that filter will also be True
-    release_else_expr = release_related_samples_to_drop_ht[left_ht.key].relationships
-    all_else_expr = related_samples_to_drop_ht[left_ht.key].relationships
+    # Look up each related samples to drop HT once and reuse the joined row for
+    # both the related boolean and the relationship filters
+    release_related_expr = release_related_samples_to_drop_ht[left_ht.key]
+    all_related_expr = related_samples_to_drop_ht[left_ht.key]
+    release_else_expr = release_related_expr.relationships
+    all_else_expr = all_related_expr.relationships
     left_ht = left_ht.annotate(
         sample_filters=left_ht.sample_filters.annotate(
             release_related=hl.if_else(
                 left_ht.sample_filters.hard_filtered,
                 hl.null(hl.tbool),
-                hl.is_defined(release_related_samples_to_drop_ht[left_ht.key]),
+                hl.is_defined(release_related_expr),
             ),
             release_duplicate=get_relationship_filter_expr(
                 left_ht.sample_filters.hard_filtered,
@@ -1072,7 +1080,7 @@ def generate_metadata(regressed_metrics_outlier: bool = True) -> hl.Table:
             all_samples_related=hl.if_else(
                 left_ht.sample_filters.hard_filtered,
                 hl.null(hl.tbool),
-                hl.is_defined(related_samples_to_drop_ht[left_ht.key]),
+                hl.is_defined(all_related_expr),
             ),
             all_samples_duplicate=get_relationship_filter_expr(
                 left_ht.sample_filters.hard_filtered,
@@ -1293,7 +1301,7 @@ def main(args):  # noqa: D103
         )
 
         with hl.hadoop_open(pop_rf_path(), "wb") as out:
-            pickle.dump(pops_rf_model, out)
+            pickle.dump(pops_rf_model, out, protocol=4)
 
     if args.calculate_inbreeding:
         qc_mt = qc.mt()
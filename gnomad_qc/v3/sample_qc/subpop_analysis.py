@@ -1,16 +1,22 @@
 # noqa: D100
 
 import argparse
+import functools
 import logging
+from typing import Union
 
 import hail as hl
 from gnomad.resources.grch38.reference_data import lcr_intervals
-from gnomad.resources.resource_utils import DataException
+from gnomad.resources.resource_utils import (
+    DataException,
+    TableResource,
+    VersionedTableResource,
+)
 from gnomad.sample_qc.ancestry import run_pca_with_relateds
 from gnomad.sample_qc.pipeline import get_qc_mt
 from gnomad.utils.annotations import get_adj_expr
 from gnomad.utils.file_utils import check_file_exists_raise_error
-from gnomad.utils.slack import slack_notifications
+from gnomad.utils.vcf import SITE_FIELDS
 
 from gnomad_qc.v3.resources import release_sites
 from gnomad_qc.v3.resources.annotations import get_info
@@ -136,9 +142,22 @@ For example, curation is needed to remove "Costa Rican" and "Indigenous American
 """
 
 
+@functools.lru_cache(maxsize=None)
+def _read_ht(resource: Union[TableResource, VersionedTableResource]) -> hl.Table:
+    """
+    Read the Table for a resource, reusing the same Table for repeated calls.
+
+    :param resource: TableResource or VersionedTableResource to read
+    :return: Table for the resource
+    """
+    return resource.ht()
+
+
 def compute_subpop_qc_mt(
     mt: hl.MatrixTable,
     min_popmax_af: float = 0.001,
+    release_ht: hl.Table = None,
+    lcr_ht: hl.Table = None,
 ) -> hl.MatrixTable:
     """
     Generate the subpop QC MT to be used for all subpop analyses.
@@ -147,17 +166,22 @@ def compute_subpop_qc_mt(
 
     :param mt: Raw MatrixTable to use for the subpop analysis
     :param min_popmax_af: Minimum population max variant allele frequency to retain variant for the subpop QC MatrixTable
+    :param release_ht: Optional release sites Table. If not provided, `release_sites` is read
+    :param lcr_ht: Optional low-confidence region intervals Table. If not provided, `lcr_intervals` is read
     :return: MatrixTable filtered to variants for subpop analysis
     """
-    release_ht = hl.read_table(release_sites().path)
+    if release_ht is None:
+        release_ht = _read_ht(release_sites())
+    if lcr_ht is None:
+        lcr_ht = _read_ht(lcr_intervals)
 
     # Filter to biallelic SNVs not in low-confidence regions and with a popmax
-    # above min_popmax_af
+    # above min_popmax_af, ordered with the cheapest predicates first
     qc_sites = release_ht.filter(
-        (release_ht.popmax.AF > min_popmax_af)
-        & ~release_ht.was_split
+        ~release_ht.was_split
         & hl.is_snp(release_ht.alleles[0], release_ht.alleles[1])
-        & hl.is_missing(lcr_intervals.ht()[release_ht.locus])
+        & (release_ht.popmax.AF > min_popmax_af)
+        & hl.is_missing(lcr_ht[release_ht.locus])
     )
 
     logger.info(
@@ -189,6 +213,39 @@ def compute_subpop_qc_mt(
     return mt
 
 
+def annotate_subpop_qc_mt(
+    mt: hl.MatrixTable,
+    meta_ht: hl.Table = None,
+    info_ht: hl.Table = None,
+) -> hl.MatrixTable:
+    """
+    Add the site info and sample metadata needed by `filter_subpop_qc` to the subpop QC MT.
+
+    :param mt: The QC MT output by the 'compute_subpop_qc_mt' function
+    :param meta_ht: Optional sample metadata Table. If not provided, `meta` is read
+    :param info_ht: Optional unsplit info Table. If not provided, `get_info(split=False)` is read
+    :return: QC MT annotated with site info and sample metadata
+    """
+    if meta_ht is None:
+        meta_ht = _read_ht(meta)
+
+    # Add info to the MT
+    if info_ht is None:
+        info_ht = get_info(split=False).ht()
+    # Only keep the site-level fields, no need for AS_annotations since it's
+    # bi-allelic sites only. Projecting before the join keeps the rows small
+    info_ht = info_ht.select(
+        info=info_ht.info.select(*[x for x in SITE_FIELDS if x in info_ht.info])
+    )
+    mt = mt.annotate_rows(info=info_ht[mt.row_key].info)
+    mt = mt.transmute_entries(GT=mt.LGT)
+
+    # Add sample metadata to the QC MT
+    mt = mt.annotate_cols(**meta_ht[mt.col_key])
+
+    return mt
+
+
 def filter_subpop_qc(
     mt: hl.MatrixTable,
     pop: str,
@@ -206,7 +263,7 @@ def filter_subpop_qc(
 
         Hard filtered samples are removed before running `get_qc_mt`
 
-    :param mt: The QC MT output by the 'compute_subpop_qc_mt' function
+    :param mt: The QC MT output by the 'annotate_subpop_qc_mt' function
     :param pop: Population to which the QC MT should be filtered
     :param min_af: Minimum population variant allele frequency to retain variant in QC MT
     :param min_inbreeding_coeff_threshold: Minimum site inbreeding coefficient to retain variant in QC MT
@@ -216,34 +273,22 @@ def filter_subpop_qc(
     :param block_size: If given, set the block size to this value when LD pruning
     :return: Filtered QC MT with sample metadata for the specified population to use for subpop analysis
     """
-    meta_ht = meta.ht()
-
-    # Add info to the MT
-    info_ht = get_info(split=False).ht()
-    info_ht = info_ht.annotate(
-        info=info_ht.info.select(
-            # No need for AS_annotations since it's bi-allelic sites only
-            **{x: info_ht.info[x] for x in info_ht.info if not x.startswith("AS_")}
-        )
-    )
-    mt = mt.annotate_rows(info=info_ht[mt.row_key].info)
-    mt = mt.transmute_entries(GT=mt.LGT)
-
-    # Add sample metadata to the QC MT
-    mt = mt.annotate_cols(**meta_ht[mt.col_key])
-
     # Filter the  QC MT to the specified pop
     pop_mt = mt.filter_cols(mt.population_inference.pop == pop)
 
     # Remove hard filtered samples
     pop_mt = pop_mt.filter_cols(~pop_mt.sample_filters.hard_filtered)
-    pop_mt = pop_mt.filter_rows(hl.agg.any(pop_mt.GT.is_non_ref()))
+
+    # Checkpoint the column filtered MT so the row filter below and the filtering
+    # in `get_qc_mt` read only the pop's samples
     pop_mt = pop_mt.checkpoint(
-        get_checkpoint_path("pop_mt", mt=True),
+        get_checkpoint_path(f"pop_mt.{pop}", mt=True),
         overwrite=args.overwrite,
         _read_if_exists=not args.overwrite,
     )
 
+    pop_mt = pop_mt.filter_rows(hl.agg.any(pop_mt.GT.is_non_ref()))
+
     # Generate a QC MT for the given pop
     pop_qc_mt = get_qc_mt(
         pop_mt,
@@ -377,21 +422,18 @@ def drop_small_subpops(
 
 
 def main(args):  # noqa: D103
-    pop = args.pop
+    pops = args.pop or []
     include_unreleasable_samples = args.include_unreleasable_samples
     high_quality = args.high_quality
     min_additional_subpop_samples = args.min_additional_subpop_samples
     unassigned_label = args.unassigned_label
 
-    try:
-        # Read in the raw mt
-        mt = get_gnomad_v3_mt(key_by_locus_and_alleles=True)
-
-        # Filter to test partitions if specified
-        if args.test:
-            logger.info("Filtering MT to chromosome 20")
-            mt = mt.filter_rows(mt.locus.contig == "chr20")
+    # Read the sample metadata once as it is used by multiple steps
+    meta_ht = _read_ht(meta)
 
+    # Check that outliers exist for every pop before running any of the steps
+    outliers_hts = {}
+    for pop in pops:
         if args.remove_outliers:
             check_file_exists_raise_error(
                 subpop_outliers(pop).path,
@@ -403,9 +445,18 @@ def main(args):  # noqa: D103
                     " determined after visualizing the output of --run_subpop_pca."
                 ),
             )
-            outliers_ht = subpop_outliers(pop).ht()
+            outliers_hts[pop] = subpop_outliers(pop).ht()
         else:
-            outliers_ht = None
+            outliers_hts[pop] = None
+
+    try:
+        # Read in the raw mt
+        mt = get_gnomad_v3_mt(key_by_locus_and_alleles=True)
+
+        # Filter to test partitions if specified
+        if args.test:
+            logger.info("Filtering MT to chromosome 20")
+            mt = mt.filter_rows(mt.locus.contig == "chr20")
 
         # Write out the densified MT
         if args.make_full_subpop_qc_mt:
@@ -426,135 +477,151 @@ def main(args):  # noqa: D103
                 )
             else:
                 mt = subpop_qc.mt()
-            mt = filter_subpop_qc(
-                mt,
-                pop,
-                args.min_af,
-                args.min_inbreeding_coeff_threshold,
-                args.min_hardy_weinberg_threshold,
-                args.ld_r2,
-                args.n_partitions,
-                args.block_size,
-            )
-
-            mt.write(
-                get_checkpoint_path("test_checkpoint_filtered_subpop_qc", mt=True)
-                if args.test
-                else filtered_subpop_qc_mt(pop),
-                overwrite=args.overwrite,
-            )
 
-        if args.run_subpop_pca:
-            # Read in the QC MT for a specified subpop and filter samples based on
-            # user parameters
-            mt = hl.read_matrix_table(
-                get_checkpoint_path("test_checkpoint_filtered_subpop_qc", mt=True)
-                if args.test
-                else filtered_subpop_qc_mt(pop)
-            )
-            if not include_unreleasable_samples:
-                mt = mt.filter_cols(
-                    mt.project_meta.releasable
-                    & ~mt.project_meta.exclude  # See https://github.com/broadinstitute/gnomad_meta/tree/master/v3.1#gnomad-project-metadata-annotation-definitions for further explanation of 'exclude'
+            # Add the info and sample metadata once and reuse the annotated MT for
+            # every requested pop
+            mt = annotate_subpop_qc_mt(mt, meta_ht=meta_ht)
+            for pop in pops:
+                logger.info("Filtering subpop QC MT to %s...", pop)
+                pop_mt = filter_subpop_qc(
+                    mt,
+                    pop,
+                    args.min_af,
+                    args.min_inbreeding_coeff_threshold,
+                    args.min_hardy_weinberg_threshold,
+                    args.ld_r2,
+                    args.n_partitions,
+                    args.block_size,
                 )
-            if high_quality:
-                mt = mt.filter_cols(mt.high_quality)
-
-            logger.info("Generating PCs for subpops...")
-            relateds_ht = pca_related_samples_to_drop.ht()
-            pop_pca_evals, pop_pca_scores, pop_pca_loadings = run_pca_with_relateds(
-                qc_mt=mt,
-                related_samples_to_drop=relateds_ht,
-                additional_samples_to_drop=outliers_ht,
-                n_pcs=args.n_pcs,
-            )
-
-            pop_pca_evals_ht = hl.Table.parallelize(
-                hl.literal(
-                    [
-                        {"PC": i + 1, "eigenvalue": x}
-                        for i, x in enumerate(pop_pca_evals)
-                    ],
-                    "array<struct{PC: int, eigenvalue: float}>",
+                pop_mt.write(
+                    get_checkpoint_path(
+                        f"test_checkpoint_filtered_subpop_qc.{pop}", mt=True
+                    )
+                    if args.test
+                    else filtered_subpop_qc_mt(pop),
+                    overwrite=args.overwrite,
                 )
-            )
-            pop_pca_evals_ht.write(
-                get_checkpoint_path("test_pop_pca_evals_ht")
-                if args.test
-                else ancestry_pca_eigenvalues(
-                    include_unreleasable_samples, high_quality, pop
-                ).path,
-                overwrite=args.overwrite,
-            )
-            pop_pca_scores.write(
-                get_checkpoint_path("test_pop_pca_scores_ht")
-                if args.test
-                else ancestry_pca_scores(
-                    include_unreleasable_samples, high_quality, pop
-                ).path,
-                overwrite=args.overwrite,
-            )
-            pop_pca_loadings.write(
-                get_checkpoint_path("test_pop_pca_loadings_ht")
-                if args.test
-                else ancestry_pca_loadings(
-                    include_unreleasable_samples, high_quality, pop
-                ).path,
-                overwrite=args.overwrite,
-            )
 
-        if args.assign_subpops:
-            logger.info("Assigning subpops...")
-            joint_pca_ht, joint_pca_fit = assign_pops(
-                min_prob=args.min_prob,
-                include_unreleasable_samples=False,
-                max_number_mislabeled_training_samples=args.max_number_mislabeled_training_samples,
-                max_proportion_mislabeled_training_samples=args.max_proportion_mislabeled_training_samples,
-                pcs=args.pcs,
-                withhold_prop=args.withhold_prop,
-                pop=pop,
-                curated_subpops=CURATED_SUBPOPS[pop],
-                additional_samples_to_drop=outliers_ht,
-                high_quality=high_quality,
-                missing_label=unassigned_label,
-            )
+        for pop in pops:
+            outliers_ht = outliers_hts[pop]
 
-            # Add metadata to subpop inference results
-            meta_ht = meta.ht()
-
-            meta_ht = meta_ht.select(
-                meta_ht.project_meta.subpop_description,
-                meta_ht.project_meta.research_project,
-                meta_ht.project_meta.project_id,
-                meta_ht.project_meta.title,
-                meta_ht.project_meta.broad_external,
-                meta_ht.project_meta.releasable,
-                hgdp_or_tgp=meta_ht.subsets.hgdp | meta_ht.subsets.tgp,
-            )
+            if args.run_subpop_pca:
+                # Read in the QC MT for a specified subpop and filter samples based on
+                # user parameters
+                mt = hl.read_matrix_table(
+                    get_checkpoint_path(
+                        f"test_checkpoint_filtered_subpop_qc.{pop}", mt=True
+                    )
+                    if args.test
+                    else filtered_subpop_qc_mt(pop)
+                )
+                if not include_unreleasable_samples:
+                    mt = mt.filter_cols(
+                        mt.project_meta.releasable
+                        & ~mt.project_meta.exclude  # See https://github.com/broadinstitute/gnomad_meta/tree/master/v3.1#gnomad-project-metadata-annotation-definitions for further explanation of 'exclude'
+                    )
+                if high_quality:
+                    mt = mt.filter_cols(mt.high_quality)
+
+                logger.info("Generating PCs for subpops...")
+                relateds_ht = _read_ht(pca_related_samples_to_drop)
+                pop_pca_evals, pop_pca_scores, pop_pca_loadings = run_pca_with_relateds(
+                    qc_mt=mt,
+                    related_samples_to_drop=relateds_ht,
+                    additional_samples_to_drop=outliers_ht,
+                    n_pcs=args.n_pcs,
+                )
 
-            joint_pca_ht = joint_pca_ht.annotate(**meta_ht[joint_pca_ht.key])
+                pop_pca_evals_ht = hl.Table.parallelize(
+                    hl.literal(
+                        [
+                            {"PC": i + 1, "eigenvalue": x}
+                            for i, x in enumerate(pop_pca_evals)
+                        ],
+                        "array<struct{PC: int, eigenvalue: float}>",
+                    )
+                )
+                pop_pca_evals_ht.write(
+                    get_checkpoint_path(f"test_pop_pca_evals_ht.{pop}")
+                    if args.test
+                    else ancestry_pca_eigenvalues(
+                        include_unreleasable_samples, high_quality, pop
+                    ).path,
+                    overwrite=args.overwrite,
+                )
+                # The scores Table only has one row per sample, so optionally
+                # coalesce it to avoid writing many tiny partitions
+                if args.pca_scores_n_partitions is not None:
+                    pop_pca_scores = pop_pca_scores.naive_coalesce(
+                        args.pca_scores_n_partitions
+                    )
+                pop_pca_scores.write(
+                    get_checkpoint_path(f"test_pop_pca_scores_ht.{pop}")
+                    if args.test
+                    else ancestry_pca_scores(
+                        include_unreleasable_samples, high_quality, pop
+                    ).path,
+                    overwrite=args.overwrite,
+                )
+                pop_pca_loadings.write(
+                    get_checkpoint_path(f"test_pop_pca_loadings_ht.{pop}")
+                    if args.test
+                    else ancestry_pca_loadings(
+                        include_unreleasable_samples, high_quality, pop
+                    ).path,
+                    overwrite=args.overwrite,
+                )
 
-            if min_additional_subpop_samples:
-                logger.info(
-                    "Dropping small subpops (subpops with < %d samples added) ...",
-                    min_additional_subpop_samples,
+            if args.assign_subpops:
+                logger.info("Assigning subpops...")
+                joint_pca_ht, joint_pca_fit = assign_pops(
+                    min_prob=args.min_prob,
+                    include_unreleasable_samples=False,
+                    max_number_mislabeled_training_samples=args.max_number_mislabeled_training_samples,
+                    max_proportion_mislabeled_training_samples=args.max_proportion_mislabeled_training_samples,
+                    pcs=args.pcs,
+                    withhold_prop=args.withhold_prop,
+                    pop=pop,
+                    curated_subpops=CURATED_SUBPOPS[pop],
+                    additional_samples_to_drop=outliers_ht,
+                    high_quality=high_quality,
+                    missing_label=unassigned_label,
                 )
-                joint_pca_ht = drop_small_subpops(
-                    joint_pca_ht, min_additional_subpop_samples, unassigned_label
+
+                # Add metadata to subpop inference results
+                subpop_meta_ht = meta_ht.select(
+                    meta_ht.project_meta.subpop_description,
+                    meta_ht.project_meta.research_project,
+                    meta_ht.project_meta.project_id,
+                    meta_ht.project_meta.title,
+                    meta_ht.project_meta.broad_external,
+                    meta_ht.project_meta.releasable,
+                    hgdp_or_tgp=meta_ht.subsets.hgdp | meta_ht.subsets.tgp,
                 )
 
-            # Annotate final subpop inference results, always keeping known labels
-            # from HGDP/1KG
-            joint_pca_ht = joint_pca_ht.annotate(
-                subpop=(
-                    hl.case()
-                    .when(joint_pca_ht.hgdp_or_tgp, joint_pca_ht.subpop_description)
-                    .when(hl.is_defined(joint_pca_ht.subpop), joint_pca_ht.subpop)
-                    .default(unassigned_label)
+                joint_pca_ht = joint_pca_ht.annotate(**subpop_meta_ht[joint_pca_ht.key])
+
+                if min_additional_subpop_samples:
+                    logger.info(
+                        "Dropping small subpops (subpops with < %d samples added) ...",
+                        min_additional_subpop_samples,
+                    )
+                    joint_pca_ht = drop_small_subpops(
+                        joint_pca_ht, min_additional_subpop_samples, unassigned_label
+                    )
+
+                # Annotate final subpop inference results, always keeping known labels
+                # from HGDP/1KG
+                joint_pca_ht = joint_pca_ht.annotate(
+                    subpop=(
+                        hl.case()
+                        .when(joint_pca_ht.hgdp_or_tgp, joint_pca_ht.subpop_description)
+                        .when(hl.is_defined(joint_pca_ht.subpop), joint_pca_ht.subpop)
+                        .default(unassigned_label)
+                    )
                 )
-            )
 
-            joint_pca_ht.write(assigned_subpops(pop).path, overwrite=args.overwrite)
+                joint_pca_ht.write(assigned_subpops(pop).path, overwrite=args.overwrite)
 
     finally:
         logger.info("Copying hail log to logging bucket...")
@@ -607,10 +674,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--pop",
         help=(
-            "Population to which the subpop QC MT should be filtered when generating"
-            " the PCA data."
+            "Population(s) to which the subpop QC MT should be filtered when generating"
+            " the PCA data. When multiple pops are given, each step is run for every"
+            " pop and the annotated subpop QC MT is shared by all pops."
         ),
         type=str,
+        nargs="+",
     )
     parser.add_argument(
         "--run-subpop-pca",
@@ -627,6 +696,14 @@ if __name__ == "__main__":
         type=int,
         default=20,
     )
+    parser.add_argument(
+        "--pca-scores-n-partitions",
+        help=(
+            "Number of desired partitions for the subpop PCA scores output Table. If"
+            " not set, the partitioning of the PCA scores Table is kept."
+        ),
+        type=int,
+    )
     parser.add_argument(
         "--min-af",
         help=(
@@ -759,7 +836,20 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if not args.pop and (
+        args.run_filter_subpop_qc
+        or args.run_subpop_pca
+        or args.assign_subpops
+        or args.remove_outliers
+    ):
+        parser.error(
+            "--pop is required with --run-filter-subpop-qc, --run-subpop-pca,"
+            " --assign-subpops and --remove-outliers."
+        )
+
     if args.slack_channel:
+        from gnomad.utils.slack import slack_notifications
+
         from gnomad_qc.slack_creds import slack_token
 
         with slack_notifications(slack_token, args.slack_channel):
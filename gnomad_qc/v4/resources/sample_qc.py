@@ -1,5 +1,6 @@
 """Script containing sample QC related resources."""
-from typing import Optional
+import functools
+from typing import Optional, Union
 
 import hail as hl
 from gnomad.resources.resource_utils import (
@@ -13,6 +14,7 @@ from gnomad_qc.v4.resources.basics import get_checkpoint_path, qc_temp_prefix
 from gnomad_qc.v4.resources.constants import CURRENT_VERSION, VERSIONS
 
 
+@functools.lru_cache(maxsize=None)
 def get_sample_qc_root(
     version: str = CURRENT_VERSION, test: bool = False, data_type="exomes"
 ) -> str:
@@ -31,11 +33,43 @@ def get_sample_qc_root(
     )
 
 
+def _versioned_resource(
+    subdir: str,
+    name: str,
+    resource_cls: type = TableResource,
+    data_type: str = "exomes",
+) -> Union[VersionedTableResource, VersionedMatrixTableResource]:
+    """
+    Get a versioned sample QC resource with a version for each version in `VERSIONS`.
+
+    :param subdir: Subdirectory of the sample QC root, e.g. "hard_filtering"
+    :param name: File name following the data type and version, e.g. "sex.ht"
+    :param resource_cls: TableResource or MatrixTableResource. Default is TableResource
+    :param data_type: Data type used in sample QC, e.g. "exomes" or "joint"
+    :return: VersionedTableResource or VersionedMatrixTableResource for the resource
+    """
+    versioned_cls = (
+        VersionedMatrixTableResource
+        if resource_cls is MatrixTableResource
+        else VersionedTableResource
+    )
+    return versioned_cls(
+        CURRENT_VERSION,
+        {
+            version: resource_cls(
+                f"{get_sample_qc_root(version, data_type=data_type)}/{subdir}/gnomad.{data_type}.v{version}.{name}"
+            )
+            for version in VERSIONS
+        },
+    )
+
+
 ######################################################################
 # Hard-filtering resources
 ######################################################################
 
 
+@functools.lru_cache(maxsize=None)
 def get_sample_qc(
     strat: str = "all", test: bool = False, data_type: str = "exomes"
 ) -> VersionedTableResource:
@@ -64,56 +98,22 @@ def get_sample_qc(
 
 
 # v4 samples that failed fingerprinting.
-fingerprinting_failed = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/hard_filtering/gnomad.exomes.v{version}.fingerprintcheck_failures.ht"
-        )
-        for version in VERSIONS
-    },
+fingerprinting_failed = _versioned_resource(
+    "hard_filtering", "fingerprintcheck_failures.ht"
 )
 
 # Mean chr20 DP per sample using Hail's interval_coverage results.
-sample_chr20_mean_dp = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/hard_filtering/gnomad.exomes.v{version}.sample_chr20_mean_dp.ht"
-        )
-        for version in VERSIONS
-    },
-)
+sample_chr20_mean_dp = _versioned_resource("hard_filtering", "sample_chr20_mean_dp.ht")
 
 # Sample contamination estimate Table.
-contamination = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/hard_filtering/gnomad.exomes.v{version}.contamination.ht"
-        )
-        for version in VERSIONS
-    },
-)
+contamination = _versioned_resource("hard_filtering", "contamination.ht")
 
-hard_filtered_samples_no_sex = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/hard_filtering/gnomad.exomes.v{version}.hard_filtered_samples_no_sex.ht"
-        )
-        for version in VERSIONS
-    },
+hard_filtered_samples_no_sex = _versioned_resource(
+    "hard_filtering", "hard_filtered_samples_no_sex.ht"
 )
 
-hard_filtered_samples = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/hard_filtering/gnomad.exomes.v{version}.hard_filtered_samples.ht"
-        )
-        for version in VERSIONS
-    },
+hard_filtered_samples = _versioned_resource(
+    "hard_filtering", "hard_filtered_samples.ht"
 )
 
 ######################################################################
@@ -121,125 +121,44 @@ hard_filtered_samples = VersionedTableResource(
 ######################################################################
 
 # VDS Hail interval_coverage results.
-interval_coverage = VersionedMatrixTableResource(
-    CURRENT_VERSION,
-    {
-        version: MatrixTableResource(
-            f"{get_sample_qc_root(version)}/platform_inference/gnomad.exomes.v{version}.interval_coverage.mt"
-        )
-        for version in VERSIONS
-    },
+interval_coverage = _versioned_resource(
+    "platform_inference", "interval_coverage.mt", MatrixTableResource
 )
 
-
-def _get_platform_pca_ht_path(part: str, version: str = CURRENT_VERSION) -> str:
-    """
-    Get path to files related to platform PCA.
-
-    :param part: String indicating the type of PCA file to return (loadings, eigenvalues, or scores)
-    :param version: Version of sample QC path to return
-    :return: Path to requested platform PCA file
-    """
-    return f"{get_sample_qc_root(version)}/platform_inference/gnomad.exomes.v{version}.platform_pca_{part}.ht"
-
-
-platform_pca_loadings = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            _get_platform_pca_ht_path(
-                "loadings",
-                version,
-            )
-        )
-        for version in VERSIONS
-    },
+platform_pca_loadings = _versioned_resource(
+    "platform_inference", "platform_pca_loadings.ht"
 )
 
-platform_pca_scores = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            _get_platform_pca_ht_path(
-                "scores",
-                version,
-            )
-        )
-        for version in VERSIONS
-    },
+platform_pca_scores = _versioned_resource(
+    "platform_inference", "platform_pca_scores.ht"
 )
 
-platform_pca_eigenvalues = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            _get_platform_pca_ht_path(
-                "eigenvalues",
-                version,
-            )
-        )
-        for version in VERSIONS
-    },
+platform_pca_eigenvalues = _versioned_resource(
+    "platform_inference", "platform_pca_eigenvalues.ht"
 )
 
 # Inferred sample platforms.
-platform = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/platform_inference/gnomad.exomes.v{version}.platform.ht"
-        )
-        for version in VERSIONS
-    },
-)
+platform = _versioned_resource("platform_inference", "platform.ht")
 
 ######################################################################
 # Sex inference resources
 ######################################################################
 
 # HT with bi-allelic SNPs on chromosome X used in sex imputation f-stat calculation.
-f_stat_sites = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/sex_inference/gnomad.exomes.v{version}.f_stat_sites.ht"
-        )
-        for version in VERSIONS
-    },
-)
+f_stat_sites = _versioned_resource("sex_inference", "f_stat_sites.ht")
 
 # Sex chromosome coverage aggregate stats MT.
-sex_chr_coverage = VersionedMatrixTableResource(
-    CURRENT_VERSION,
-    {
-        version: MatrixTableResource(
-            f"{get_sample_qc_root(version)}/sex_inference/gnomad.exomes.v{version}.sex_chr_coverage.mt"
-        )
-        for version in VERSIONS
-    },
+sex_chr_coverage = _versioned_resource(
+    "sex_inference", "sex_chr_coverage.mt", MatrixTableResource
 )
 
 # Table containing aggregate stats for interval QC specific to sex imputation.
-sex_imputation_interval_qc = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/sex_inference/gnomad.exomes.v{version}.sex_imputation_interval_qc.ht"
-        )
-        for version in VERSIONS
-    },
+sex_imputation_interval_qc = _versioned_resource(
+    "sex_inference", "sex_imputation_interval_qc.ht"
 )
 
 # Ploidy imputation results.
-ploidy = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/sex_inference/gnomad.exomes.v{version}.ploidy.ht"
-        )
-        for version in VERSIONS
-    },
-)
+ploidy = _versioned_resource("sex_inference", "ploidy.ht")
 
 
 # Sex imputation results.
@@ -259,41 +178,17 @@ def get_ploidy_cutoff_json_path(
         return f"{get_sample_qc_root(version)}/sex_inference/gnomad.exomes.v{version}.ploidy_cutoffs.json"
 
 
-sex = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/sex_inference/gnomad.exomes.v{version}.sex.ht"
-        )
-        for version in VERSIONS
-    },
-)
+sex = _versioned_resource("sex_inference", "sex.ht")
 
 ######################################################################
 # Interval QC resources
 ######################################################################
 
 # Table containing aggregate stats for interval QC.
-interval_qc = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/interval_qc/gnomad.exomes.v{version}.interval_qc.ht"
-        )
-        for version in VERSIONS
-    },
-)
+interval_qc = _versioned_resource("interval_qc", "interval_qc.ht")
 
 # Table with interval QC pass annotation.
-interval_qc_pass = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/interval_qc/gnomad.exomes.v{version}.interval_qc_pass.ht"
-        )
-        for version in VERSIONS
-    },
-)
+interval_qc_pass = _versioned_resource("interval_qc", "interval_qc_pass.ht")
 
 
 ######################################################################
@@ -301,6 +196,7 @@ interval_qc_pass = VersionedTableResource(
 ######################################################################
 
 
+@functools.lru_cache(maxsize=None)
 def get_predetermined_qc(
     version: str = CURRENT_VERSION, test: bool = False
 ) -> MatrixTableResource:
@@ -333,17 +229,12 @@ v3_predetermined_qc = MatrixTableResource(
 )
 
 # gnomAD v4 dense MT of all predetermined possible QC sites `predetermined_qc_sites`.
-v4_predetermined_qc = VersionedMatrixTableResource(
-    CURRENT_VERSION,
-    {
-        version: MatrixTableResource(
-            f"{get_sample_qc_root(version)}/qc_mt/gnomad.exomes.v{version}.pre_ld_prune_qc_sites.dense.mt"
-        )
-        for version in VERSIONS
-    },
+v4_predetermined_qc = _versioned_resource(
+    "qc_mt", "pre_ld_prune_qc_sites.dense.mt", MatrixTableResource
 )
 
 
+@functools.lru_cache(maxsize=None)
 def get_joint_qc(test: bool = False) -> VersionedMatrixTableResource:
     """
     Get the dense MatrixTableResource at final joint v3 and v4 QC sites.
@@ -363,14 +254,8 @@ def get_joint_qc(test: bool = False) -> VersionedMatrixTableResource:
 
 
 # v3 and v4 combined sample metadata Table for relatedness and population inference.
-joint_qc_meta = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version, data_type='joint')}/qc_mt/gnomad.joint.v{version}.qc_meta.ht"
-        )
-        for version in VERSIONS
-    },
+joint_qc_meta = _versioned_resource(
+    "qc_mt", "qc_meta.ht", TableResource, data_type="joint"
 )
 
 
@@ -407,6 +292,7 @@ def get_cuking_output_path(version: str = CURRENT_VERSION, test: bool = False) -
     return f"{qc_temp_prefix(version)}cuking_output{'_test' if test else ''}.parquet"
 
 
+@functools.lru_cache(maxsize=None)
 def pc_relate_pca_scores(test: bool = False) -> VersionedTableResource:
     """
     Get VersionedTableResource for PCA scores for use in PC-Relate.
@@ -425,6 +311,11 @@ def pc_relate_pca_scores(test: bool = False) -> VersionedTableResource:
     )
 
 
+# Methods of relatedness inference with their own relatedness results Table.
+_RELATEDNESS_METHODS = frozenset({"cuking", "pc_relate"})
+
+
+@functools.lru_cache(maxsize=None)
 def relatedness(
     method: Optional[str] = None, test: bool = False
 ) -> VersionedTableResource:
@@ -440,7 +331,7 @@ def relatedness(
     if method is None:
         method = ""
     else:
-        if method not in {"cuking", "pc_relate"}:
+        if method not in _RELATEDNESS_METHODS:
             raise ValueError("method must be one of 'cuking' or 'pc_relate'!")
         method = f".{method}"
 
@@ -455,6 +346,7 @@ def relatedness(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def ibd(test: bool = False) -> VersionedTableResource:
     """
     Get VersionedTableResource for identity-by-descent (ibd) on cuKING related pairs.
@@ -473,6 +365,7 @@ def ibd(test: bool = False) -> VersionedTableResource:
     )
 
 
+@functools.lru_cache(maxsize=None)
 def related_samples_to_drop(
     test: bool = False, release: bool = True
 ) -> VersionedTableResource:
@@ -499,6 +392,7 @@ def related_samples_to_drop(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def sample_rankings(test: bool = False, release: bool = True) -> VersionedTableResource:
     """
     Get the VersionedTableResource for sample rankings for release or ancestry PCA.
@@ -525,15 +419,7 @@ def sample_rankings(test: bool = False, release: bool = True) -> VersionedTableR
 
 
 # Duplicated (or twin) samples.
-duplicates = VersionedTableResource(
-    CURRENT_VERSION,
-    {
-        version: TableResource(
-            f"{get_sample_qc_root(version)}/relatedness/gnomad.exomes.v{version}.duplicates.ht"
-        )
-        for version in VERSIONS
-    },
-)
+duplicates = _versioned_resource("relatedness", "duplicates.ht")
 
 
 ######################################################################
@@ -541,6 +427,25 @@ duplicates = VersionedTableResource(
 ######################################################################
 
 
+@functools.lru_cache(maxsize=None)
+def _get_ancestry_pca_ht_prefix(
+    version: str = CURRENT_VERSION,
+    test: bool = False,
+    data_type: str = "joint",
+) -> str:
+    """
+    Get the path prefix shared by all ancestry PCA files.
+
+    :param version: Version of sample QC path to return.
+    :param test: Whether to use a tmp path for a test resource.
+    :param data_type: Data type used in sample QC, e.g. "exomes" or "joint"
+    :return: Prefix of the ancestry PCA file paths.
+    """
+    return (
+        f"{get_sample_qc_root(version, test, data_type)}/gnomad.{data_type}.v{version}.pca_"
+    )
+
+
 def _get_ancestry_pca_ht_path(
     part: str,
     version: str = CURRENT_VERSION,
@@ -557,30 +462,34 @@ def _get_ancestry_pca_ht_path(
     :param data_type: Data type used in sample QC, e.g. "exomes" or "joint"
     :return: Path to requested ancestry PCA file.
     """
-    return (
-        f"{get_sample_qc_root(version, test, data_type)}/gnomad.{data_type}.v{version}.pca_{part}{'_with_unreleasable_samples' if include_unreleasable_samples else ''}.ht"
-    )
+    prefix = _get_ancestry_pca_ht_prefix(version, test, data_type)
+    postfix = "_with_unreleasable_samples" if include_unreleasable_samples else ""
 
+    return f"{prefix}{part}{postfix}.ht"
 
-def ancestry_pca_loadings(
+
+@functools.lru_cache(maxsize=None)
+def _ancestry_pca(
+    part: str,
     include_unreleasable_samples: bool = False,
     test: bool = False,
     data_type: str = "joint",
 ) -> VersionedTableResource:
     """
-    Get the ancestry PCA loadings VersionedTableResource.
+    Get the VersionedTableResource of an ancestry PCA output.
 
-    :param include_unreleasable_samples: Whether to get the PCA loadings from the PCA that used unreleasable samples.
+    :param part: String indicating the type of PCA file to return (loadings, eigenvalues, or scores).
+    :param include_unreleasable_samples: Whether the PCA included unreleasable samples.
     :param test: Whether to use a temp path.
     :param data_type: Data type used in sample QC, e.g. "exomes" or "joint"
-    :return: Ancestry PCA loadings
+    :return: Ancestry PCA VersionedTableResource for `part`
     """
     return VersionedTableResource(
         CURRENT_VERSION,
         {
             version: TableResource(
                 _get_ancestry_pca_ht_path(
-                    "loadings", version, include_unreleasable_samples, test, data_type
+                    part, version, include_unreleasable_samples, test, data_type
                 )
             )
             for version in VERSIONS
@@ -588,6 +497,22 @@ def ancestry_pca_loadings(
     )
 
 
+def ancestry_pca_loadings(
+    include_unreleasable_samples: bool = False,
+    test: bool = False,
+    data_type: str = "joint",
+) -> VersionedTableResource:
+    """
+    Get the ancestry PCA loadings VersionedTableResource.
+
+    :param include_unreleasable_samples: Whether to get the PCA loadings from the PCA that used unreleasable samples.
+    :param test: Whether to use a temp path.
+    :param data_type: Data type used in sample QC, e.g. "exomes" or "joint"
+    :return: Ancestry PCA loadings
+    """
+    return _ancestry_pca("loadings", include_unreleasable_samples, test, data_type)
+
+
 def ancestry_pca_scores(
     include_unreleasable_samples: bool = False,
     test: bool = False,
@@ -601,17 +526,7 @@ def ancestry_pca_scores(
     :param data_type: Data type used in sample QC, e.g. "exomes" or "joint"
     :return: Ancestry PCA scores
     """
-    return VersionedTableResource(
-        CURRENT_VERSION,
-        {
-            version: TableResource(
-                _get_ancestry_pca_ht_path(
-                    "scores", version, include_unreleasable_samples, test, data_type
-                )
-            )
-            for version in VERSIONS
-        },
-    )
+    return _ancestry_pca("scores", include_unreleasable_samples, test, data_type)
 
 
 def ancestry_pca_eigenvalues(
@@ -627,21 +542,7 @@ def ancestry_pca_eigenvalues(
     :param data_type: Data type used in sample QC, e.g. "exomes" or "joint"
     :return: Ancestry PCA eigenvalues
     """
-    return VersionedTableResource(
-        CURRENT_VERSION,
-        {
-            version: TableResource(
-                _get_ancestry_pca_ht_path(
-                    "eigenvalues",
-                    version,
-                    include_unreleasable_samples,
-                    test,
-                    data_type,
-                )
-            )
-            for version in VERSIONS
-        },
-    )
+    return _ancestry_pca("eigenvalues", include_unreleasable_samples, test, data_type)
 
 
 def pop_rf_path(
@@ -713,6 +614,7 @@ def per_pop_min_rf_probs_json_path(version: str = CURRENT_VERSION):
 ######################################################################
 # Outlier detection resources
 ######################################################################
+@functools.lru_cache(maxsize=None)
 def stratified_filtering(
     test: bool = False,
     pop_stratified: bool = False,
@@ -744,6 +646,7 @@ def stratified_filtering(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def regressed_filtering(
     test: bool = False,
     pop_pc_regressed: bool = False,
@@ -784,6 +687,7 @@ def regressed_filtering(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def nearest_neighbors(
     test: bool = False,
     platform_stratified: bool = False,
@@ -815,6 +719,7 @@ def nearest_neighbors(
     )
 
 
+@functools.lru_cache(maxsize=None)
 def nearest_neighbors_filtering(test: bool = False) -> VersionedTableResource:
     """
     Get VersionedTableResource for nearest neighbors platform/population-based metrics filtering.
@@ -833,6 +738,7 @@ def nearest_neighbors_filtering(test: bool = False) -> VersionedTableResource:
     )
 
 
+@functools.lru_cache(maxsize=None)
 def finalized_outlier_filtering(test: bool = False) -> VersionedTableResource:
     """
     Get VersionedTableResource for the finalized outlier filtering.
@@ -92,7 +92,8 @@ def run_pca(
     :return: Eigenvalues, scores and loadings from PCA.
     """
     logger.info("Running population PCA")
-    qc_mt = get_joint_qc(test=test).mt()
+    # Only GT is used by the PCA, so drop the other entries before reading them
+    qc_mt = get_joint_qc(test=test).mt().select_entries("GT")
     joint_meta = joint_qc_meta.ht()
     samples_to_drop = related_samples_to_drop.select()
 
@@ -298,10 +299,9 @@ def write_pca_results(
     :return: None
     """
     pop_pca_eigenvalues_ht = hl.Table.parallelize(
-        hl.literal(
-            [{"PC": i + 1, "eigenvalue": x} for i, x in enumerate(pop_pca_eigenvalues)],
-            "array<struct{PC: int, eigenvalue: float}>",
-        )
+        [{"PC": i + 1, "eigenvalue": x} for i, x in enumerate(pop_pca_eigenvalues)],
+        hl.tstruct(PC=hl.tint32, eigenvalue=hl.tfloat64),
+        n_partitions=1,
     )
     pop_pca_eigenvalues_ht.write(
         ancestry_pca_eigenvalues(included_unreleasables, test).path,
@@ -530,7 +530,7 @@ def main(args):
                 pop_rf_path(test=test),
                 "wb",
             ) as out:
-                pickle.dump(pops_rf_model, out)
+                pickle.dump(pops_rf_model, out, protocol=4)
 
         if args.compute_precision_recall:
             ht = compute_precision_recall(